@@ -44,33 +44,45 @@ from contextlib import AsyncExitStack
 
 from . import app_config
 from .bms_state_combiner import BMSStateCombiner
-from .lv_bms import BMSIn, BMSOut
+from .lv_bms import BMSIn, BMSOut, StateFanIn
 from .mqtt_broadcaster import MQTTBroadcaster
 
+# The libuv-based uvloop event loop is used if installed (optional dependency)
+try:
+    from uvloop import run as run_event_loop
+except ImportError:
+    from asyncio import run as run_event_loop
+
 parser = argparse.ArgumentParser(prog=__package__, description=__doc__)
 parser.add_argument("--init", action="store_true", help="Initialize configuration file and exit")
 parser.add_argument("-v", "--verbose", action="store_true", help="Enable verbose (debug) output")
-cmdline = parser.parse_args()
 
 logger = logging.getLogger(__name__)
-logging.basicConfig(level=logging.DEBUG if cmdline.verbose else logging.INFO)
-
-
-# App configuration read from file: "~/bms_gateway/bms_config.toml"
-# Default configuration: See source tree file "bms_config_default.toml"
-conf = app_config.init_or_read_from_config_file(init=cmdline.init)
 
 t_main: threading.Thread | None = None
-thread_stop = threading.Event()
+# Event loop and input state fan-in of the running main task, used by stop_app()
+main_loop: asyncio.AbstractEventLoop | None = None
+main_fan_in: StateFanIn | None = None
 
-combiner = BMSStateCombiner(conf.battery)
+# Configuration and state combiner of the running main task, see get_config()
+# and get_combiner(). These are private, because "from .app import *" in the
+# package __init__ would only copy the initial None values.
+_conf: app_config.AppConfig | None = None
+_combiner: BMSStateCombiner | None = None
 
 
-async def main_task() -> None:
+async def main_task(conf: app_config.AppConfig) -> None:
     """Receives BMS input data, combines and broadcasts to all inverters."""
+    global main_loop, main_fan_in, _conf, _combiner  # noqa: PLW0603
+    main_loop = asyncio.get_running_loop()
+    _conf = conf
+    _combiner = state_combiner = BMSStateCombiner(conf.battery)
     mqtt_out: MQTTBroadcaster | None = None
     async with AsyncExitStack() as stack:
-        bmses_in = [BMSIn(bms_conf) for bms_conf in conf.bmses_in]
+        # Input BMS receive tasks signal state updates via common fan-in.
+        # This is also woken up by stop_app(), for ending the main loop.
+        main_fan_in = fan_in = StateFanIn()
+        bmses_in = [BMSIn(bms_conf, fan_in) for bms_conf in conf.bmses_in]
         for bms in bmses_in:
             await stack.enter_async_context(bms)
         bmses_out = [BMSOut(bms_conf) for bms_conf in conf.bmses_out]
@@ -79,40 +91,94 @@ async def main_task() -> None:
         if conf.mqtt.ACTIVATED:
             mqtt_out = MQTTBroadcaster(conf.mqtt)
             await stack.enter_async_context(mqtt_out)
-        while not thread_stop.is_set():
-            # Read all input BMSes
-            getters = (bms.get_state() for bms in bmses_in)
-            states_in = await asyncio.gather(*getters)
+        # Input BMS state objects are updated in place by the receive tasks,
+        # so this list is set up once and is read by the combiner each cycle.
+        states_in = [bms.state for bms in bmses_in]
+        # Wait for a fresh state update from all input BMSes, or for stop
+        while await fan_in.wait_all_fresh():
             # Calculate total and average values, error flags and corrections
-            state_out = combiner.calculate_result_state(states_in)
-            logger.debug(state_out)
+            state_out = state_combiner.calculate_result_state(states_in)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("%s", state_out)
             # Set calculated state on all virtual output BMSes.
             # Individual current scaling values are applied from config file.
-            setters = (bms.set_state(state_out) for bms in bmses_out)
-            await asyncio.gather(*setters)
+            # This only encodes the state and wakes up the transmit tasks,
+            # so the output BMSes are simply updated one after the other.
+            for bms in bmses_out:
+                await bms.set_state(state_out)
             if mqtt_out is not None:
                 await mqtt_out.set_state(state_out)
 
 
-def run_app() -> None:
-    """Run app in foreground (also as a system service)."""
+def run_app(args: list[str] | None = None) -> None:
+    """Run app in foreground (also as a system service).
+
+    Args:
+        args:   command line arguments, default is to use sys.argv
+
+    """
+    cmdline = parser.parse_args(args)
+    logging.basicConfig(level=logging.DEBUG if cmdline.verbose else logging.INFO)
+    # App configuration read from file: "~/bms_gateway/bms_config.toml"
+    # Default configuration: See source tree file "bms_config_default.toml"
+    conf = app_config.init_or_read_from_config_file(init=cmdline.init)
     try:  # noqa: SIM105
-        asyncio.run(main_task())
+        run_event_loop(main_task(conf))
     except KeyboardInterrupt:
         pass
 
 
-def run_app_bg() -> None:
-    """Run app in background thread (for debugging in ipython etc)."""
+def run_app_bg(args: list[str] | None = None) -> None:
+    """Run app in background thread (for debugging in ipython etc).
+
+    Args:
+        args:   command line arguments, default is no arguments
+
+    """
     global t_main  # noqa: PLW0603
-    thread_stop.clear()
-    t_main = threading.Thread(target=run_app)
+    t_main = threading.Thread(target=run_app, args=(args or [],))
     t_main.start()
 
 
+def get_config() -> app_config.AppConfig:
+    """Return configuration of the running app.
+
+    Raises:
+        RuntimeError: if the app has not been started yet
+
+    """
+    if _conf is None:
+        msg = "App is not running"
+        raise RuntimeError(msg)
+    return _conf
+
+
+def get_combiner() -> BMSStateCombiner:
+    """Return state combiner of the running app, e.g. for setting current limits.
+
+    A new combiner is created on each start of the app, so setpoints
+    changed via the combiner are reset to the configured values on restart.
+
+    Raises:
+        RuntimeError: if the app has not been started yet
+
+    """
+    if _combiner is None:
+        msg = "App is not running"
+        raise RuntimeError(msg)
+    return _combiner
+
+
 def stop_app() -> None:
-    """Stop app running in background thread."""
-    thread_stop.set()
+    """Stop app running in background thread.
+
+    This has no effect if the main task has not started running yet,
+    e.g. when called immediately after run_app_bg().
+    """
+    if main_loop is None or main_fan_in is None or main_loop.is_closed():
+        logger.warning("App is not running, stop request ignored")
+        return
+    main_loop.call_soon_threadsafe(main_fan_in.stop)
 
 
 if __name__ == "__main__":
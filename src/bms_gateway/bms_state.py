@@ -3,11 +3,32 @@
 For BMS using Pylontech Protocol
 """
 
-from dataclasses import dataclass, replace
-from typing import Self
+from dataclasses import dataclass
+from typing import Self, TypeVar
 
+_T = TypeVar("_T")
 
-@dataclass
+
+def _copy_slots(obj: _T) -> _T:
+    """Return copy of a slotted dataclass object with immutable field values.
+
+    This bypasses __init__, which is about three times faster than
+    dataclasses.replace() or copy.copy().
+    """
+    cls = type(obj)
+    new = object.__new__(cls)
+    for name in cls.__slots__:  # type: ignore[attr-defined]
+        setattr(new, name, getattr(obj, name))
+    return new
+
+
+def _copy_slots_into(src: _T, dst: _T) -> None:
+    """Overwrite all fields of a slotted dataclass object in place."""
+    for name in type(src).__slots__:  # type: ignore[attr-defined]
+        setattr(dst, name, getattr(src, name))
+
+
+@dataclass(slots=True)
 class BMSState:
     """BMS state as received on the CAN bus."""
 
@@ -37,10 +58,14 @@ class BMSState:
 
     def copy(self) -> Self:
         """Return deep copy of this config object."""
-        return replace(self)
+        return _copy_slots(self)
+
+    def copy_from(self, other: Self) -> None:
+        """Overwrite all fields of this object in place with those of other."""
+        _copy_slots_into(other, self)
 
 
-@dataclass
+@dataclass(slots=True)
 class Errors:
     """BMS Error flags."""
 
@@ -65,21 +90,23 @@ class Errors:
 
     def to_flags(self) -> tuple[int, int]:
         """Return HW register flag bytes representation of own state."""
-        flags_low = int(self.oc_discharge) * 1 << 7
-        flags_low |= int(self.temp_low) * 1 << 4
-        flags_low |= int(self.temp_high) * 1 << 3
-        flags_low |= int(self.undervoltage) * 1 << 2
-        flags_low |= int(self.overvoltage) * 1 << 1
-        flags_high = int(self.system_error) * 1 << 3
-        flags_high |= int(self.oc_charge) * 1 << 0
+        # Booleans are used as integers 0 or 1 directly
+        flags_low = (
+            self.oc_discharge << 7
+            | self.temp_low << 4
+            | self.temp_high << 3
+            | self.undervoltage << 2
+            | self.overvoltage << 1
+        )
+        flags_high = self.system_error << 3 | self.oc_charge
         return flags_low, flags_high
 
     def copy(self) -> Self:
         """Return deep copy of this config object."""
-        return replace(self)
+        return _copy_slots(self)
 
 
-@dataclass
+@dataclass(slots=True)
 class Warnings:
     """BMS Warning flags."""
 
@@ -104,15 +131,17 @@ class Warnings:
 
     def to_flags(self) -> tuple[int, int]:
         """Return HW register flag bytes representation of own state."""
-        flags_low = int(self.oc_discharge) * 1 << 7
-        flags_low |= int(self.temp_low) * 1 << 4
-        flags_low |= int(self.temp_high) * 1 << 3
-        flags_low |= int(self.undervoltage) * 1 << 2
-        flags_low |= int(self.overvoltage) * 1 << 1
-        flags_high = int(self.comm_fail) * 1 << 3
-        flags_high |= int(self.oc_charge) * 1 << 0
+        # Booleans are used as integers 0 or 1 directly
+        flags_low = (
+            self.oc_discharge << 7
+            | self.temp_low << 4
+            | self.temp_high << 3
+            | self.undervoltage << 2
+            | self.overvoltage << 1
+        )
+        flags_high = self.comm_fail << 3 | self.oc_charge
         return flags_low, flags_high
 
     def copy(self) -> Self:
         """Return deep copy of this config object."""
-        return replace(self)
+        return _copy_slots(self)
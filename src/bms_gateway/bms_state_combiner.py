@@ -1,11 +1,21 @@
 """Combine n x BMS states into one (virtual BMS) output state object."""
 
 import threading
+from typing import NamedTuple
 
 from .app_config import BatteryConfig
 from .bms_state import BMSState
 
 
+class Setpoints(NamedTuple):
+    """Immutable snapshot of the combiner scaling and limiting values."""
+
+    i_lim_charge: float
+    i_lim_discharge: float
+    i_tot_scaling: float
+    i_tot_offset: float
+
+
 class BMSStateCombiner:
     """Combine n x BMS states into one (virtual BMS) output state object.
 
@@ -19,11 +29,18 @@ class BMSStateCombiner:
 
     def __init__(self, battery_conf: BatteryConfig) -> None:
         """Initialize BMSStateCombiner with emulated (virtual) battery config."""
-        self._i_lim_charge = battery_conf.I_LIM_CHARGE
-        self._i_lim_discharge = battery_conf.I_LIM_DISCHARGE
-        self._i_tot_scaling = battery_conf.I_TOT_SCALING
-        self._i_tot_offset = battery_conf.I_TOT_OFFSET
+        # All setpoints are replaced at once by assigning a new tuple.
+        # This is atomic, so the result calculation reads them without a lock.
+        self._setpoints = Setpoints(
+            battery_conf.I_LIM_CHARGE,
+            battery_conf.I_LIM_DISCHARGE,
+            battery_conf.I_TOT_SCALING,
+            battery_conf.I_TOT_OFFSET,
+        )
+        # Serializes the setters only, so that no concurrent update is lost
         self._thread_lock = threading.Lock()
+        # Result state object is allocated once and re-used for every calculation
+        self._result = BMSState()
 
     def set_i_tot_scaling(self, i_tot_scaling: float) -> None:
         """Set total current scaling factor (correction factor).
@@ -34,7 +51,7 @@ class BMSStateCombiner:
 
         """
         with self._thread_lock:
-            self._i_tot_scaling = i_tot_scaling
+            self._setpoints = self._setpoints._replace(i_tot_scaling=i_tot_scaling)
 
     def set_tot_offset(self, i_tot_offset: float) -> None:
         """Set total current offset (correction value).
@@ -45,7 +62,7 @@ class BMSStateCombiner:
 
         """
         with self._thread_lock:
-            self._i_tot_offset = i_tot_offset
+            self._setpoints = self._setpoints._replace(i_tot_offset=i_tot_offset)
 
     def set_i_lim_charge(self, i_lim_charge: float) -> None:
         """Set total current limit for charging.
@@ -55,7 +72,7 @@ class BMSStateCombiner:
 
         """
         with self._thread_lock:
-            self._i_lim_charge = i_lim_charge
+            self._setpoints = self._setpoints._replace(i_lim_charge=i_lim_charge)
 
     def set_i_lim_discharge(self, i_lim_discharge: float) -> None:
         """Set total current limit for discharging.
@@ -65,7 +82,7 @@ class BMSStateCombiner:
 
         """
         with self._thread_lock:
-            self._i_lim_discharge = i_lim_discharge
+            self._setpoints = self._setpoints._replace(i_lim_discharge=i_lim_discharge)
 
     def calculate_result_state(self, states_in: list[BMSState]) -> BMSState:
         """Calculate totalized output state.
@@ -78,31 +95,54 @@ class BMSStateCombiner:
         Args:
             states_in:  input states
         Returns:
-            output state
+            output state, which is overwritten by the next call
 
         """
-        self._thread_lock.acquire()
-        # Copy state of the first BMS to get a working copy for result calculation
-        state = states_in[0].copy()
+        # Consistent snapshot of all setpoints, read once without a lock
+        i_lim_charge, i_lim_discharge, i_tot_scaling, i_tot_offset = self._setpoints
+        state = self._result
+        if len(states_in) == 1:
+            # Single BMS: Nothing to combine, the input state is only copied.
+            # Input state must not be modified.
+            state.copy_from(states_in[0])
+        else:
+            self._combine_states_into(state, states_in)
+        # Apply scaling factor and offset to result current
+        state.i_total = state.i_total * i_tot_scaling + i_tot_offset
+        # Apply total current limits, overriding current limits set by BMSes
+        state.i_lim_charge = min(state.i_lim_charge, i_lim_charge)
+        state.i_lim_discharge = min(state.i_lim_discharge, i_lim_discharge)
+        return state
+
+    @staticmethod
+    def _combine_states_into(state: BMSState, states_in: list[BMSState]) -> None:
+        # Sums, averages and logically combines all input states into state,
+        # without applying any scaling, offset or setpoint limits.
+        # Copy state of the first BMS into the result state as a starting point.
+        # The remaining states are then taken from the same iterator, no slicing.
+        states_iter = iter(states_in)
+        state.copy_from(next(states_iter))
         # Averaged input values are weighted with each module capacity
         # and are divided by total system capacity further below
-        soc_avg = state.soc * state.capacity_ah
-        soh_avg = state.soh * state.capacity_ah
-        t_avg = state.t_avg * state.capacity_ah
-        v_avg = state.v_avg * state.capacity_ah
-        for additional in states_in[1:]:
+        capacity_ah = state.capacity_ah
+        soc_avg = state.soc * capacity_ah
+        soh_avg = state.soh * capacity_ah
+        t_avg = state.t_avg * capacity_ah
+        v_avg = state.v_avg * capacity_ah
+        for additional in states_iter:
             # For end-of-charge maximum voltage setpoint, the minimum of all
             # voltages requested by the input BMSes is calculated
             state.v_charge_cmd = min(state.v_charge_cmd, additional.v_charge_cmd)
             # Averaged input values are weighted with each module capacity
             # and are divided by total system capacity further below.
-            soc_avg += additional.soc * additional.capacity_ah
-            soh_avg += additional.soh * additional.capacity_ah
-            t_avg += additional.t_avg * additional.capacity_ah
-            v_avg += additional.v_avg * additional.capacity_ah
+            add_capacity_ah = additional.capacity_ah
+            soc_avg += additional.soc * add_capacity_ah
+            soh_avg += additional.soh * add_capacity_ah
+            t_avg += additional.t_avg * add_capacity_ah
+            v_avg += additional.v_avg * add_capacity_ah
             # Total capacity, total current and total current limis are the
             # sum of all limit values reported by the BMSes
-            state.capacity_ah += additional.capacity_ah
+            capacity_ah += add_capacity_ah
             state.i_total += additional.i_total
             # Assuming well-tuned current distribution!
             state.i_lim_charge += additional.i_lim_charge
@@ -125,17 +165,9 @@ class BMSStateCombiner:
 
         # End of for loop
         # Calculate averaged results for total system state
-        avg_factor_ah = 1.0 / state.capacity_ah
+        state.capacity_ah = capacity_ah
+        avg_factor_ah = 1.0 / capacity_ah
         state.soc = soc_avg * avg_factor_ah
         state.soh = soh_avg * avg_factor_ah
         state.v_avg = v_avg * avg_factor_ah
         state.t_avg = t_avg * avg_factor_ah
-        # Apply scaling factor and offset to result current
-        state.i_total *= self._i_tot_scaling
-        state.i_total += self._i_tot_offset
-        # Apply total current limits, overriding current limits set by BMSes
-        state.i_lim_charge = min(state.i_lim_charge, self._i_lim_charge)
-        state.i_lim_discharge = min(state.i_lim_discharge, self._i_lim_discharge)
-        # Threading lock was set above
-        self._thread_lock.release()
-        return state
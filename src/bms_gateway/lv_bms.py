@@ -2,13 +2,16 @@
 
 import asyncio
 import logging
+import struct
 import time
+from collections import deque
 from typing import Self
 
 import can
 
 from .app_config import BMSInConfig, BMSOutConfig
 from .bms_state import BMSState
+from .socketcan_mmsg import FrameBatchReader, FrameBatchWriter, set_receive_buffer_size
 
 logger = logging.getLogger(__name__)
 
@@ -16,35 +19,162 @@ logger = logging.getLogger(__name__)
 BMS_IN_BITRATE: int = 500000
 # Number of CAN frames belonging to one reply data telegram from the BMS
 N_BMS_REPLY_FRAMES: int = 6
+# Kernel socket receive buffer size in bytes for battery-side BMSs.
+# This prevents frame loss during garbage collection or scheduling hiccups.
+BMS_IN_RCVBUF_SIZE: int = 2 << 20
+# Maximum number of received CAN frames queued in the software FIFO.
+# If the FIFO is full, the oldest frames are discarded.
+BMS_IN_RX_FIFO_SIZE: int = 1024
 # CAN ID which marks the start of the data telegram sent from the BMS
 ID_BMS_TELEGRAM_START: int = 0x359
 # CAN ID which is sent by the inverter to poll the BMS (using 8x 0x00 data)
 ID_INVERTER_REQUEST: int = 0x305
+# CAN IDs of all frames of one BMS data telegram, in frame slot order
+BMS_TELEGRAM_IDS: tuple[int, ...] = (0x351, 0x355, 0x356, 0x359, 0x35C, 0x35E)
+# Frame slot index for each CAN ID of the BMS data telegram
+_FRAME_SLOTS: dict[int, int] = {can_id: slot for slot, can_id in enumerate(BMS_TELEGRAM_IDS)}
+
+# Pre-compiled data formats of the BMS telegram frames, used for
+# decoding input frames and for encoding output frames
+_S351 = struct.Struct("<Hhh")
+_S355 = struct.Struct("<HH")
+_S356 = struct.Struct("<hhh")
+_S359 = struct.Struct("<7B")
+# Input frames 0x359 are decoded without the two fixed trailing bytes
+_S359_IN = struct.Struct("<5B")
+_S35C = struct.Struct("<B")
+
+
+class StateFanIn:
+    """Event-driven fan-in of state updates from a number of input BMSes.
+
+    Each input BMS marks its own slot as fresh whenever a complete data
+    telegram was decoded. The consumer is woken up once all slots are fresh,
+    or when stop() is called.
+    """
+
+    def __init__(self) -> None:
+        """Initialize StateFanIn without any slots."""
+        self._all_fresh = asyncio.Event()
+        self._stopped: bool = False
+        self._fresh: list[bool] = []
+        self._n_stale: int = 0
+
+    def add_slot(self) -> int:
+        """Add a slot for one input BMS and return the slot index."""
+        self._fresh.append(False)
+        self._n_stale += 1
+        return len(self._fresh) - 1
+
+    def set_fresh(self, slot: int) -> None:
+        """Mark state of one input BMS as updated."""
+        if not self._fresh[slot]:
+            self._fresh[slot] = True
+            self._n_stale -= 1
+            if self._n_stale == 0:
+                self._all_fresh.set()
+
+    def stop(self) -> None:
+        """Wake up the consumer, which then sees that it has to stop.
+
+        This must be called from within the event loop thread,
+        e.g. via loop.call_soon_threadsafe().
+        """
+        self._stopped = True
+        self._all_fresh.set()
+
+    async def wait_all_fresh(self) -> bool:
+        """Wait until all input BMSes have updated their state, then reset.
+
+        Returns:
+            False if stop() was called, otherwise True
+
+        """
+        await self._all_fresh.wait()
+        if self._stopped:
+            return False
+        self._all_fresh.clear()
+        for slot in range(len(self._fresh)):
+            self._fresh[slot] = False
+        self._n_stale = len(self._fresh)
+        return True
+
+
+# Decoded BMS telegram values, in order of assignment to the BMSState fields
+_DecodedFrames = tuple[float, float, float, float, float, float, float, float, int, int, int, int, int, int, str]
+
+
+def _decode_frames(frames: list[bytes]) -> _DecodedFrames:
+    """Decode the complete set of BMS telegram frames, in frame slot order.
+
+    This is kept free of any state access, the decoded values are returned
+    as a tuple in order of the BMSState fields they are assigned to.
+    """
+    # CAN ID 0x351
+    v_charge_cmd, i_lim_charge, i_lim_discharge = _S351.unpack_from(frames[0])
+    # CAN ID 0x355
+    soc, soh = _S355.unpack_from(frames[1])
+    # CAN ID 0x356
+    v_avg, i_total, t_avg = _S356.unpack_from(frames[2])
+    # CAN ID 0x359
+    error_flags_1, error_flags_2, warning_flags_1, warning_flags_2, n_modules = _S359_IN.unpack_from(frames[3])
+    # CAN ID 0x35E
+    manufacturer = frames[5].split(b"\x00", 1)[0].decode("ascii")
+    return (
+        0.1 * v_charge_cmd,
+        0.1 * i_lim_charge,
+        0.1 * i_lim_discharge,
+        float(soc),
+        float(soh),
+        0.01 * v_avg,
+        0.1 * i_total,
+        0.1 * t_avg,
+        error_flags_1,
+        error_flags_2,
+        warning_flags_1,
+        warning_flags_2,
+        n_modules,
+        # CAN ID 0x35C
+        frames[4][0],
+        manufacturer,
+    )
 
 
 class BMSIn:
     """Representation of input-side battery BMS state."""
 
-    def __init__(self, config: BMSInConfig) -> None:
-        """Initialize an input (battery-side) BMS representation object."""
+    def __init__(self, config: BMSInConfig, fan_in: StateFanIn | None = None) -> None:
+        """Initialize an input (battery-side) BMS representation object.
+
+        If fan_in is given, each state update is signalled there. This is the
+        only update notification, the state itself is read via the state property.
+        """
         self.config = config
+        self._fan_in = fan_in
+        self._fan_in_slot = fan_in.add_slot() if fan_in is not None else 0
         self.bus: can.BusABC
-        self._reader: can.AsyncBufferedReader
+        # File descriptor of the bus socket, used for direct socket access
+        self._fd: int
+        # CAN frames are read in batches directly from the SocketCAN socket
+        # by an event loop reader callback, into a software FIFO
+        self._batch_reader = FrameBatchReader()
+        self._rx_fifo: deque[tuple[int, bytes]] = deque(maxlen=BMS_IN_RX_FIFO_SIZE)
+        self._rx_ready = asyncio.Event()
         self._state = BMSState(capacity_ah=config.CAPACITY_AH)
-        self._raw_frames: dict[int, bytearray] = {}
-        self._framecounter: int = 0
-        self._data_ready = asyncio.Condition()
-        self._can_notifier: can.Notifier
+        # Latest received data of each telegram frame, empty if not yet received
+        self._raw_frames: list[bytes] = [b""] * len(BMS_TELEGRAM_IDS)
         self._poll_task: can.CyclicSendTaskABC | None = None
         self._task_main: asyncio.Task[None]
 
     async def __aenter__(self) -> Self:
         """Async context manager entry method."""
         conf = self.config
-        loop = asyncio.get_event_loop()
+        loop = asyncio.get_running_loop()
         self.bus = can.Bus(conf.CAN_IF, "socketcan", bitrate=BMS_IN_BITRATE)
-        self._reader = can.AsyncBufferedReader()
-        self._can_notifier = can.Notifier(self.bus, [self._reader], loop=loop)
+        self._fd = self.bus.fileno()
+        set_receive_buffer_size(self._fd, BMS_IN_RCVBUF_SIZE)
+        # Drain the socket as soon as it has data available
+        loop.add_reader(self._fd, self._on_readable)
         if conf.POLL_INTERVAL is not None:
             sync_msg = can.Message(arbitration_id=ID_INVERTER_REQUEST, data=[0] * 8)
             self._poll_task = self.bus.send_periodic(sync_msg, conf.POLL_INTERVAL)
@@ -57,83 +187,98 @@ class BMSIn:
         if self._poll_task is not None:
             self._poll_task.stop()
         self._task_main.cancel()
-        self._can_notifier.stop()
+        asyncio.get_running_loop().remove_reader(self._fd)
         self.bus.shutdown()
 
-    async def get_state(self) -> BMSState:
-        """Return internal state representation."""
-        logger.debug("BMS_In:get_state() called")
-        async with self._data_ready:
-            await self._data_ready.wait()
-            return self._state
+    @property
+    def state(self) -> BMSState:
+        """Latest internal state representation, without waiting for an update.
+
+        This is always the same object, which is updated in place.
+        """
+        return self._state
+
+    # Event loop reader callback. Drains all frames ready on the socket using
+    # one single system call. If more frames are pending, the socket remains
+    # readable and this is called again by the event loop.
+    def _on_readable(self) -> None:
+        self._rx_fifo.extend(self._batch_reader.recv(self._fd))
+        self._rx_ready.set()
 
     async def _fn_task_main(self) -> None:
+        # All objects used for every received frame are bound to locals once
+        rx_fifo = self._rx_fifo
+        rx_ready = self._rx_ready
+        raw_frames = self._raw_frames
+        state = self._state
+        frame_slots = _FRAME_SLOTS
+        id_inverter_request = ID_INVERTER_REQUEST
+        id_telegram_start = ID_BMS_TELEGRAM_START
+        time_now = time.time
+        framecounter = 0
         while True:
-            msg = await self._reader.get_message()
-            # Fill in BMS reply frames into dictionary
-            self._raw_frames[msg.arbitration_id] = msg.data
-            # Inverter request or acknowledge is inverleaved with BMS reply.
-            # The inverter frame contains no data and only timestamp is logged
-            if msg.arbitration_id == ID_INVERTER_REQUEST:
-                self._state.timestamp_last_inverter_request = time.time()
-            elif msg.arbitration_id == ID_BMS_TELEGRAM_START:
-                if self._framecounter >= N_BMS_REPLY_FRAMES:
-                    try:
-                        self._decode_frames_update_state(self._raw_frames)
-                        async with self._data_ready:
-                            self._data_ready.notify_all()
-                    except ValueError as e:
-                        logger.warning(e.args[0])
-                self._framecounter = 1
-            else:
-                self._framecounter += 1
-
-    def _decode_frames_update_state(self, frames: dict[int, bytearray]) -> None:
+            await rx_ready.wait()
+            rx_ready.clear()
+            while rx_fifo:
+                can_id, data = rx_fifo.popleft()
+                # Fill in BMS reply frames into their frame slots
+                slot = frame_slots.get(can_id)
+                if slot is not None:
+                    raw_frames[slot] = data
+                # Inverter request or acknowledge is inverleaved with BMS reply.
+                # The inverter frame contains no data and only timestamp is logged
+                if can_id == id_inverter_request:
+                    state.timestamp_last_inverter_request = time_now()
+                elif can_id == id_telegram_start:
+                    if (
+                        framecounter >= N_BMS_REPLY_FRAMES
+                        and self._decode_frames_update_state(raw_frames)
+                        and self._fan_in is not None
+                    ):
+                        self._fan_in.set_fresh(self._fan_in_slot)
+                    framecounter = 1
+                else:
+                    framecounter += 1
+
+    # Returns True if the state was updated, otherwise a warning is logged
+    def _decode_frames_update_state(self, frames: list[bytes]) -> bool:
         state = self._state
-        try:
-            # CAN ID 0x351
-            msg = frames[0x351]
-            state.v_charge_cmd = 0.1 * int.from_bytes(msg[0:2], "little")
-            state.i_lim_charge = 0.1 * int.from_bytes(msg[2:4], "little", signed=True)
-            state.i_lim_discharge = 0.1 * int.from_bytes(msg[4:6], "little", signed=True)
-            # CAN ID 0x355
-            msg = frames[0x355]
-            state.soc = float(int.from_bytes(msg[0:2], "little"))
-            state.soh = float(int.from_bytes(msg[2:4], "little"))
-            # CAN ID 0x356
-            msg = frames[0x356]
-            state.v_avg = 0.01 * int.from_bytes(msg[0:2], "little", signed=True)
-            state.i_total = 0.1 * int.from_bytes(msg[2:4], "little", signed=True)
-            state.t_avg = 0.1 * int.from_bytes(msg[4:6], "little", signed=True)
-            # CAN ID 0x359
-            msg = frames[0x359]
-            state.error_flags_1 = msg[0]
-            state.error_flags_2 = msg[1]
-            state.warning_flags_1 = msg[2]
-            state.warning_flags_2 = msg[3]
-            state.n_modules = msg[4]
-            # CAN ID 0x35C
-            msg = frames[0x35C]
-            # The status flags are individually treated
-            state.charge_enable = bool(msg[0] & 1 << 7)
-            state.discharge_enable = bool(msg[0] & 1 << 6)
-            state.force_charge_request = bool(msg[0] & 1 << 5)
-            state.force_charge_request_2 = bool(msg[0] & 1 << 4)
-            state.balancing_charge_request = bool(msg[0] & 1 << 3)
-            # CAN ID 0x35E
-            msg = frames[0x35E]
-            state.manufacturer = msg.decode().rstrip("\x00")
-        # Operator "<=" tests if left set is a subset of the set on the right side
-        # if not {0x351, 0x355, 0x356, 0x359, 0x35C, 0x35E} <= frames.keys():
-        except KeyError as e:
-            txt = f"Incomplete set of data frames received. ID: {hex(e.args[0])}"
+        # Missing frames are expected after startup, no exception is raised
+        if not all(frames):
             state.n_invalid_data_telegrams += 1
-            raise ValueError(txt) from e
-        except (IndexError, ValueError, UnicodeDecodeError) as e:
-            txt = f"Invalid data received. Details: {e.args[0]}"
+            missing_id = BMS_TELEGRAM_IDS[frames.index(b"")]
+            logger.warning("Incomplete set of data frames received. ID: %s", hex(missing_id))
+            return False
+        try:
+            (
+                state.v_charge_cmd,
+                state.i_lim_charge,
+                state.i_lim_discharge,
+                state.soc,
+                state.soh,
+                state.v_avg,
+                state.i_total,
+                state.t_avg,
+                state.error_flags_1,
+                state.error_flags_2,
+                state.warning_flags_1,
+                state.warning_flags_2,
+                state.n_modules,
+                status_flags,
+                state.manufacturer,
+            ) = _decode_frames(frames)
+        except (IndexError, ValueError, UnicodeDecodeError, struct.error) as e:
             state.n_invalid_data_telegrams += 1
-            raise ValueError(txt) from e
+            logger.warning("Invalid data received. Details: %s", e.args[0])
+            return False
+        # The status flags are individually treated
+        state.charge_enable = bool(status_flags & 1 << 7)
+        state.discharge_enable = bool(status_flags & 1 << 6)
+        state.force_charge_request = bool(status_flags & 1 << 5)
+        state.force_charge_request_2 = bool(status_flags & 1 << 4)
+        state.balancing_charge_request = bool(status_flags & 1 << 3)
         state.timestamp_last_bms_update = time.time()
+        return True
 
 
 class BMSOut:
@@ -143,20 +288,28 @@ class BMSOut:
         """Initialize an output-side (emulated battery) BMS object."""
         self.config = config
         self.bus: can.BusABC
+        # File descriptor of the bus socket, used for direct socket access
+        self._fd: int
         self._reader: can.AsyncBufferedReader
-        self._output_msgs: list[can.Message] = self._bms_encode(BMSState())
+        # All output frames are sent to the inverter using one system call
+        self._output_frames = FrameBatchWriter(N_BMS_REPLY_FRAMES)
+        # Manufacturer string and its encoded 0x35E frame data, cached
+        self._manufacturer: tuple[str, bytes] = ("", b"\x00")
+        self._bms_encode(BMSState())
         # Option A: Send BMS state data cyclically when sync_interval is given
         self._task_transmit_sync: can.CyclicSendTaskABC | None = None
         # Option B: Send BMS state data when a SYNC message is received
         self._task_transmit_state: asyncio.Task[None]
-        self._data_valid = asyncio.Condition()
+        # Set by set_state() when new output frame data is ready to be sent
+        self._data_valid = asyncio.Event()
         self._can_notifier: can.Notifier
 
     async def __aenter__(self) -> Self:
         """Async context manager entry method."""
         conf = self.config
-        loop = asyncio.get_event_loop()
+        loop = asyncio.get_running_loop()
         self.bus = can.Bus(conf.CAN_IF, "socketcan", bitrate=BMS_IN_BITRATE)
+        self._fd = self.bus.fileno()
         self._reader = can.AsyncBufferedReader()
         self._can_notifier = can.Notifier(self.bus, [self._reader], loop=loop)
         if conf.SEND_SYNC_ACTIVATED:
@@ -194,84 +347,94 @@ class BMSOut:
 
     async def set_state(self, state: BMSState) -> None:
         """Set state of emulated output-side (connected to iverter) BMS."""
-        logger.debug("BMS_Out:set_state() called")
-        async with self._data_valid:
-            self._output_msgs.clear()
-            self._output_msgs.extend(self._bms_encode(state))
-            self._data_valid.notify_all()
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("BMS_Out:set_state() called")
+        self._bms_encode(state)
+        self._data_valid.set()
 
     # Normal mode: Push state updates to the connected inverter as soon as available
     async def _fn_task_push(self) -> None:
+        push_min_delay = self.config.PUSH_MIN_DELAY
         while True:
             # Limit push data rate if this is > 0.0 seconds
-            await asyncio.sleep(self.config.PUSH_MIN_DELAY)
-            # Send state to inverter once _data_valid is notified by set_state()
-            async with self._data_valid:
-                await self._data_valid.wait()
-                for msg in self._output_msgs:
-                    self.bus.send(msg)
+            if push_min_delay > 0.0:
+                await asyncio.sleep(push_min_delay)
+            # Send state to inverter once _data_valid is set by set_state()
+            await self._data_valid.wait()
+            self._data_valid.clear()
+            self._send_output_frames()
 
     # If config.SEND_SYNC_ACTIVATED is set, instead of push mode, we wait for
     # an inverter sync/acqknowledge-telegram (CAN-ID 0x305, data 8x 0x00)
     # before sending the state update.
     async def _fn_task_reply(self) -> None:
+        get_message = self._reader.get_message
+        data_valid = self._data_valid
         while True:
             # Read incoming CAN msgs until a SYNC message is received
             while True:
-                msg = await self._reader.get_message()
+                msg = await get_message()
                 if msg.arbitration_id == ID_INVERTER_REQUEST:
                     break
             # SYNC message was received, reply by sending state to inverter
-            # once _data_valid is notified by set_state()
-            async with self._data_valid:
-                await self._data_valid.wait()
-                for msg in self._output_msgs:
-                    self.bus.send(msg)
+            # once _data_valid is set by set_state()
+            await data_valid.wait()
+            data_valid.clear()
+            self._send_output_frames()
+
+    def _send_output_frames(self) -> None:
+        try:
+            self._output_frames.send(self._fd)
+        except OSError as e:
+            logger.warning("Sending state to inverter on %s failed: %s", self.config.CAN_IF, e)
 
-    def _bms_encode(self, state: BMSState) -> list[can.Message]:
+    # Encodes state into the output frame buffers
+    def _bms_encode(self, state: BMSState) -> None:
         conf = self.config
         # Apply inverter current setpoint limits in addition to battery limits
         i_lim_charge = min(state.i_lim_charge, conf.I_LIM_CHARGE)
         i_lim_discharge = min(state.i_lim_discharge, conf.I_LIM_DISCHARGE)
         # Apply inverter current scaling factor and offset for this inverter
         i_total = state.i_total * conf.I_SCALING + conf.I_OFFSET
-        # Generate outgoing CAN messages
-        msg_351 = (
-            int(10 * state.v_charge_cmd).to_bytes(2, "little")
-            + int(10 * i_lim_charge).to_bytes(2, "little", signed=True)
-            + int(10 * i_lim_discharge).to_bytes(2, "little", signed=True)
+        # Pack outgoing CAN frame data in place into the output frame buffers
+        frames = self._output_frames
+        frames.pack_frame(
+            0,
+            0x351,
+            _S351,
+            int(10 * state.v_charge_cmd),
+            int(10 * i_lim_charge),
+            int(10 * i_lim_discharge),
         )
-        msg_355 = int(state.soc).to_bytes(2, "little") + int(state.soh).to_bytes(2, "little")
-        msg_356 = (
-            int(100 * state.v_avg).to_bytes(2, "little", signed=True)
-            + int(10 * i_total).to_bytes(2, "little", signed=True)
-            + int(10 * state.t_avg).to_bytes(2, "little", signed=True)
+        frames.pack_frame(1, 0x355, _S355, int(state.soc), int(state.soh))
+        frames.pack_frame(2, 0x356, _S356, int(100 * state.v_avg), int(10 * i_total), int(10 * state.t_avg))
+        frames.pack_frame(
+            3,
+            0x359,
+            _S359,
+            state.error_flags_1,
+            state.error_flags_2,
+            state.warning_flags_1,
+            state.warning_flags_2,
+            state.n_modules,
+            # Following two bytes are fixed values according to Pylontech spec
+            0x50,
+            0x4E,
         )
-        msg_359 = bytes(
-            (
-                state.error_flags_1,
-                state.error_flags_2,
-                state.warning_flags_1,
-                state.warning_flags_2,
-                state.n_modules,
-                # Following two bytes are fixed values according to Pylontech spec
-                0x50,
-                0x4E,
-            ),
-        )
-        msg_35c = (
+        frames.pack_frame(
+            4,
+            0x35C,
+            _S35C,
             state.charge_enable << 7
             | state.discharge_enable << 6
             | state.force_charge_request << 5
             | state.force_charge_request_2 << 4
-            | state.balancing_charge_request << 3
-        ).to_bytes()
-        msg_35e = state.manufacturer.encode("ascii") + b"\x00"
-        return [
-            can.Message(arbitration_id=0x351, is_extended_id=False, data=msg_351),
-            can.Message(arbitration_id=0x355, is_extended_id=False, data=msg_355),
-            can.Message(arbitration_id=0x356, is_extended_id=False, data=msg_356),
-            can.Message(arbitration_id=0x359, is_extended_id=False, data=msg_359),
-            can.Message(arbitration_id=0x35C, is_extended_id=False, data=msg_35c),
-            can.Message(arbitration_id=0x35E, is_extended_id=False, data=msg_35e),
-        ]
+            | state.balancing_charge_request << 3,
+        )
+        # Manufacturer string is not expected to change, encode only once
+        manufacturer, msg_35e = self._manufacturer
+        if state.manufacturer != manufacturer:
+            # CAN frame data is limited to 8 bytes
+            msg_35e = (state.manufacturer.encode("ascii") + b"\x00")[:8]
+            self._manufacturer = (state.manufacturer, msg_35e)
+        frames.set_frame(5, 0x35E, msg_35e)
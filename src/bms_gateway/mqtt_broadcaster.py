@@ -1,12 +1,12 @@
 """MQTT telemetry broadcaster for bms_gateway."""
 
 import asyncio
-import dataclasses
-import json
 import logging
+import socket
 from typing import Self
 
 import aiomqtt
+import orjson
 
 from .app_config import MQTTConfig
 from .bms_state import BMSState
@@ -15,6 +15,12 @@ logger = logging.getLogger(__name__)
 
 # Does this test the connection?
 MQTT_TIMEOUT: float = 5.0
+# Delay in seconds before reconnecting to the broker after a connection error.
+# This is doubled after each failed attempt, up to the maximum value.
+MQTT_RECONNECT_DELAY_MIN: float = 1.0
+MQTT_RECONNECT_DELAY_MAX: float = 60.0
+# Small state messages are sent right away, without Nagle algorithm delay
+MQTT_SOCKET_OPTIONS: tuple[tuple[int, int, int], ...] = ((socket.IPPROTO_TCP, socket.TCP_NODELAY, 1),)
 
 
 class MQTTBroadcaster:
@@ -25,12 +31,14 @@ class MQTTBroadcaster:
         self.config = config
         self._state = BMSState()
         self._task_publish_mqtt: asyncio.Task[None]
-        self._data_valid = asyncio.Condition()
+        # Set by set_state() when a new state is available for publishing
+        self._data_valid = asyncio.Event()
         self._client = aiomqtt.Client(
             config.BROKER,
             config.PORT,
             clean_session=True,
             timeout=MQTT_TIMEOUT,
+            socket_options=MQTT_SOCKET_OPTIONS,
         )
 
     async def __aenter__(self) -> Self:
@@ -46,20 +54,57 @@ class MQTTBroadcaster:
 
     async def set_state(self, state: BMSState) -> None:
         """Set state to be broadcasted over MQTT."""
-        async with self._data_valid:
-            self._state = state
-            self._data_valid.notify_all()
+        self._state = state
+        self._data_valid.set()
 
-    # Periodically sends BMS data broadcast on the specified bus
+    # Connects to the broker and publishes the state. The same client object
+    # is re-used for reconnecting after a connection error or broker restart.
     async def _fn_task_publish_mqtt(self) -> None:
         conf = self.config
-        loop = asyncio.get_event_loop()
-        async with self._client as client:
-            next_call = loop.time()
-            while True:
-                async with self._data_valid:
-                    await self._data_valid.wait()
-                    msg_json = json.dumps(dataclasses.asdict(self._state))
-                await client.publish(conf.TOPIC, msg_json)
-                next_call += conf.INTERVAL
-                await asyncio.sleep(next_call - loop.time())
+        reconnect_delay = MQTT_RECONNECT_DELAY_MIN
+        while True:
+            try:
+                async with self._client as client:
+                    reconnect_delay = MQTT_RECONNECT_DELAY_MIN
+                    await self._publish_states(client)
+            except aiomqtt.MqttError as e:
+                logger.warning(
+                    "MQTT connection to %s:%s failed: %s. Reconnecting in %.0f seconds",
+                    conf.BROKER,
+                    conf.PORT,
+                    e,
+                    reconnect_delay,
+                )
+            await asyncio.sleep(reconnect_delay)
+            reconnect_delay = min(2 * reconnect_delay, MQTT_RECONNECT_DELAY_MAX)
+
+    # Periodically sends BMS data broadcast on the specified bus.
+    # The state is serialized only once per publish interval.
+    async def _publish_states(self, client: aiomqtt.Client) -> None:
+        # Bind everything used once per publish to locals
+        publish = client.publish
+        topic = self.config.TOPIC
+        interval = self.config.INTERVAL
+        data_valid = self._data_valid
+        loop_time = asyncio.get_running_loop().time
+        next_call = loop_time()
+        while True:
+            await data_valid.wait()
+            data_valid.clear()
+            # orjson serializes the dataclass directly, without a dict copy
+            payload = orjson.dumps(self._state)
+            try:
+                # Fire and forget, a lost state is superseded by the next one
+                await publish(topic, payload, qos=0)
+            except aiomqtt.MqttError:
+                # Keep the state pending, it is then published after reconnecting
+                data_valid.set()
+                raise
+            next_call += interval
+            now = loop_time()
+            if next_call < now:
+                # Publishing is late, e.g. after input BMS updates stopped
+                # or a broker stall. Skip the missed intervals instead of
+                # catching up with a burst of publishes.
+                next_call = now + interval
+            await asyncio.sleep(next_call - now)
@@ -0,0 +1,215 @@
+"""Batched reading and writing of CAN frames on a Linux SocketCAN raw socket.
+
+python-can reads or writes one CAN frame per system call. On bursty buses, the
+per-frame system call overhead dominates CPU load. Using the recvmmsg(2) and
+sendmmsg(2) system calls, a batch of frames is read or written with one
+single call using pre-allocated frame buffers.
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import functools
+import os
+import socket
+import struct
+from collections.abc import Iterator
+
+# Size in bytes of the Linux kernel "struct can_frame" (classic CAN)
+CAN_FRAME_SIZE: int = 16
+# Maximum number of CAN frames read with a single system call
+RX_BATCH_SIZE: int = 64
+# Flag bits of the can_id field: extended frame format, remote transmission
+# request and error frame. Not exported by the Python socket module on all systems.
+CAN_EFF_FLAG: int = 0x80000000
+CAN_RTR_FLAG: int = 0x40000000
+CAN_ERR_FLAG: int = 0x20000000
+# Linux socket option, not exported by the Python socket module
+SO_RCVBUFFORCE: int = 33
+
+# Offset of the data field in struct can_frame
+CAN_DATA_OFFSET: int = 8
+
+# struct can_frame: u32 can_id, u8 len, 3x padding/reserved, u8 data[8]
+_CAN_FRAME = struct.Struct("=IB3x8s")
+_CAN_FRAME_HEADER = struct.Struct("=IB3x")
+
+
+class _IOVec(ctypes.Structure):
+    _fields_ = (
+        ("iov_base", ctypes.c_void_p),
+        ("iov_len", ctypes.c_size_t),
+    )
+
+
+class _MsgHdr(ctypes.Structure):
+    _fields_ = (
+        ("msg_name", ctypes.c_void_p),
+        ("msg_namelen", ctypes.c_uint32),
+        ("msg_iov", ctypes.POINTER(_IOVec)),
+        ("msg_iovlen", ctypes.c_size_t),
+        ("msg_control", ctypes.c_void_p),
+        ("msg_controllen", ctypes.c_size_t),
+        ("msg_flags", ctypes.c_int),
+    )
+
+
+class _MMsgHdr(ctypes.Structure):
+    _fields_ = (
+        ("msg_hdr", _MsgHdr),
+        ("msg_len", ctypes.c_uint),
+    )
+
+
+@functools.cache
+def _libc() -> ctypes.CDLL:
+    """Load the C library and declare the recvmmsg() and sendmmsg() signatures.
+
+    This is done on first use, so that importing this module does not fail
+    on platforms which do not have these Linux-specific system calls.
+    """
+    libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+    libc.recvmmsg.argtypes = (
+        ctypes.c_int,
+        ctypes.POINTER(_MMsgHdr),
+        ctypes.c_uint,
+        ctypes.c_int,
+        ctypes.c_void_p,
+    )
+    libc.recvmmsg.restype = ctypes.c_int
+    libc.sendmmsg.argtypes = (
+        ctypes.c_int,
+        ctypes.POINTER(_MMsgHdr),
+        ctypes.c_uint,
+        ctypes.c_int,
+    )
+    libc.sendmmsg.restype = ctypes.c_int
+    return libc
+
+
+def _alloc_msgvec(
+    n_frames: int,
+) -> tuple[ctypes.Array[ctypes.c_char], ctypes.Array[_IOVec], ctypes.Array[_MMsgHdr]]:
+    """Allocate frame buffer and message headers, one CAN frame per message."""
+    frames = ctypes.create_string_buffer(n_frames * CAN_FRAME_SIZE)
+    iovecs = (_IOVec * n_frames)()
+    msgvec = (_MMsgHdr * n_frames)()
+    frames_addr = ctypes.addressof(frames)
+    for i in range(n_frames):
+        iovecs[i].iov_base = frames_addr + i * CAN_FRAME_SIZE
+        iovecs[i].iov_len = CAN_FRAME_SIZE
+        msgvec[i].msg_hdr.msg_iov = ctypes.pointer(iovecs[i])
+        msgvec[i].msg_hdr.msg_iovlen = 1
+    return frames, iovecs, msgvec
+
+
+def set_receive_buffer_size(fd: int, size: int) -> None:
+    """Set kernel receive buffer size in bytes of a SocketCAN raw socket.
+
+    SO_RCVBUFFORCE overrides the net.core.rmem_max limit but needs the
+    CAP_NET_ADMIN capability. Without it, SO_RCVBUF is used instead, which
+    is silently limited to net.core.rmem_max by the kernel.
+    """
+    with socket.fromfd(fd, socket.AF_CAN, socket.SOCK_RAW, socket.CAN_RAW) as sock:
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, SO_RCVBUFFORCE, size)
+        except PermissionError:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, size)
+
+
+class FrameBatchReader:
+    """Read a batch of CAN frames from a SocketCAN raw socket in one system call.
+
+    Message header, I/O vector and frame buffer arrays are allocated once
+    and are re-used for every call.
+    """
+
+    def __init__(self, batch_size: int = RX_BATCH_SIZE) -> None:
+        """Allocate receive buffers for up to batch_size CAN frames."""
+        self._batch_size = batch_size
+        self._recvmmsg = _libc().recvmmsg
+        self._frames, self._iovecs, self._msgvec = _alloc_msgvec(batch_size)
+        self._frames_view = memoryview(self._frames).cast("B")
+
+    def recv(self, fd: int) -> Iterator[tuple[int, bytes]]:
+        """Read all frames which are ready, up to batch size, without blocking.
+
+        Error frames and remote transmission request frames are skipped.
+        Extended frame IDs are returned with the CAN_EFF_FLAG bit set,
+        so that these never equal a standard frame ID.
+
+        Args:
+            fd:     file descriptor of a SocketCAN raw socket
+        Returns:
+            iterator over (CAN ID, data bytes) tuples
+
+        """
+        n_frames = self._recvmmsg(fd, self._msgvec, self._batch_size, socket.MSG_DONTWAIT, None)
+        if n_frames < 0:
+            err = ctypes.get_errno()
+            if err in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                return
+            raise OSError(err, os.strerror(err))
+        for i in range(n_frames):
+            can_id, length, data = _CAN_FRAME.unpack_from(self._frames_view, i * CAN_FRAME_SIZE)
+            if can_id & (CAN_ERR_FLAG | CAN_RTR_FLAG):
+                continue
+            yield can_id, data[:length]
+
+
+class FrameBatchWriter:
+    """Write a fixed set of CAN frames to a SocketCAN raw socket in one system call.
+
+    Frame contents are updated in place using set_frame(), all frames
+    are then sent at once using send().
+    """
+
+    def __init__(self, n_frames: int) -> None:
+        """Allocate transmit buffers for n_frames CAN frames."""
+        self._n_frames = n_frames
+        self._sendmmsg = _libc().sendmmsg
+        self._frames, self._iovecs, self._msgvec = _alloc_msgvec(n_frames)
+        self._frames_view = memoryview(self._frames).cast("B")
+
+    def set_frame(self, index: int, can_id: int, data: bytes) -> None:
+        """Set CAN ID and data (max. 8 bytes) of the frame at given index."""
+        _CAN_FRAME.pack_into(self._frames_view, index * CAN_FRAME_SIZE, can_id, len(data), data)
+
+    def pack_frame(self, index: int, can_id: int, packer: struct.Struct, *values: int) -> None:
+        """Set CAN ID of the frame at given index and pack values into its data field.
+
+        Args:
+            index:      frame index
+            can_id:     CAN ID
+            packer:     pre-compiled data format, max. 8 bytes in size
+            values:     values to pack
+
+        """
+        offset = index * CAN_FRAME_SIZE
+        _CAN_FRAME_HEADER.pack_into(self._frames_view, offset, can_id, packer.size)
+        packer.pack_into(self._frames_view, offset + CAN_DATA_OFFSET, *values)
+
+    def send(self, fd: int) -> None:
+        """Send all frames without blocking.
+
+        Args:
+            fd:     file descriptor of a SocketCAN raw socket
+        Raises:
+            OSError: if the frames could not be sent. When the socket
+                     transmit buffer is full, any frames not yet sent
+                     are dropped and this is raised as well.
+
+        """
+        n_sent = 0
+        msg_size = ctypes.sizeof(_MMsgHdr)
+        while n_sent < self._n_frames:
+            msgvec = ctypes.cast(ctypes.addressof(self._msgvec) + n_sent * msg_size, ctypes.POINTER(_MMsgHdr))
+            result = self._sendmmsg(fd, msgvec, self._n_frames - n_sent, socket.MSG_DONTWAIT)
+            if result < 0:
+                err = ctypes.get_errno()
+                if err == errno.EINTR:
+                    continue
+                if err in (errno.EAGAIN, errno.EWOULDBLOCK, errno.ENOBUFS):
+                    raise OSError(err, "Transmit buffer full")
+                raise OSError(err, os.strerror(err))
+            n_sent += result
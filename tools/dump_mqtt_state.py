@@ -3,7 +3,7 @@
 import asyncio
 from typing import cast
 import aiomqtt
-import json
+import orjson
 from pprint import pformat
 
 from bms_gateway import app_config
@@ -17,8 +17,8 @@ conf = app_config.init_or_read_from_config_file()
 # Double-buffered text output
 screen = TextScreen()
 
-async def print_msg(msg: aiomqtt.Message) -> None:
-    msg_dict = json.loads(cast(bytes, msg.payload))
+def print_msg(msg: aiomqtt.Message) -> str:
+    msg_dict = orjson.loads(cast(bytes, msg.payload))
     state = BMSState(**msg_dict)
     errors = Errors().from_flags(state.error_flags_1, state.error_flags_2)
     warnings = Warnings().from_flags(state.warning_flags_1, state.warning_flags_2)
@@ -27,6 +27,12 @@ async def print_msg(msg: aiomqtt.Message) -> None:
                  f"\x1b[33m{pformat(warnings)}\n\x1b[0m")
     screen.put(f"{state_str}\n *******  Got state update!  *******\n")
     screen.refresh()
+    return state_str
+
+
+# Removes the update notice after a while. This runs as a separate task,
+# so that receiving of further messages is not blocked meanwhile.
+async def clear_update_notice(state_str: str) -> None:
     await asyncio.sleep(2.0)
     screen.put(f"{state_str}\n\n")
     screen.refresh()
@@ -37,8 +43,12 @@ async def main_task() -> None:
         await client.subscribe(conf.mqtt.TOPIC)
         print(f"\nSubscribed to {conf.mqtt.TOPIC} on {conf.mqtt.BROKER}..\n"
               "Press CTRL-C to exit!\n")
+        task_clear_notice: asyncio.Task[None] | None = None
         async for msg in client.messages:
-            await print_msg(msg)
+            if task_clear_notice is not None:
+                task_clear_notice.cancel()
+            state_str = print_msg(msg)
+            task_clear_notice = asyncio.create_task(clear_update_notice(state_str))
 
 
 def run_app() -> None: